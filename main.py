@@ -1,17 +1,18 @@
-import pandas as pd
+import numpy as np
+import polars as pl
 import os
+from contextlib import nullcontext
+from datetime import datetime, timedelta, timezone
 from rich.console import Console
 from rich.table import Table
 from rich.progress import Progress
 from rich.panel import Panel
 from rich.text import Text
+from stock_cache import data_dir, csv_path, parquet_path, prepare_cache
 
 # Initialize Rich console
 console = Console()
 
-# Directory containing the CSV files
-data_dir = './data'
-
 # Specific stocks to process (without .csv)
 target_files = ['AAPL', 'WMT', 'GOOGL', 'AMZN', 'MSFT', 'TSLA', 'META', 'NFLX', 'BA', 'DIS', 'PYPL', 'V', 'MA', 'INTC', 'IBM', 'AMD']
 # target_files = [f.split('.')[0] for f in os.listdir(data_dir) if f.endswith('.csv')]
@@ -19,132 +20,177 @@ target_files = ['AAPL', 'WMT', 'GOOGL', 'AMZN', 'MSFT', 'TSLA', 'META', 'NFLX',
 # Date for purchasing the stock
 purchase_date = '2024-03-01'
 
-# Total budget and split percentage
-total_budget = 900
-split_percentage = 1 / len(target_files)  # Equal split for each stock
-
-# Initialize results dictionary
-results = {}
+# UTC bounds of the purchase day, so rows are matched without formatting each date
+purchase_ts_start = datetime.fromisoformat(purchase_date).replace(tzinfo=timezone.utc)
+purchase_ts_end = purchase_ts_start + timedelta(days=1)
 
-# Ensure the directory exists and has files
-if not os.path.exists(data_dir) or not os.listdir(data_dir):
-    console.print("[bold red]No files found in the data directory.[/bold red]")
-    exit()
+# Show a progress bar when processing more stocks than this one by one; for a few files redrawing it costs more than the work
+progress_threshold = 50
 
-# Initialize progress bar
-with Progress() as progress:
-    task = progress.add_task("[cyan]Processing stock files...", total=len(target_files))
-    
-    # Process files
-    for stock_name in target_files:
-        file_name = f"{stock_name}.csv"
-        file_path = os.path.join(data_dir, file_name)
-        
-        if not os.path.exists(file_path):
-            console.print(f"[yellow]File {file_name} not found. Skipping.[/yellow]")
-            progress.advance(task)
-            continue
-        
-        try:
-            # Read the CSV file
-            data = pd.read_csv(file_path)
-            
-            # Check for required columns
-            if not {'Date', 'Low', 'Close'}.issubset(data.columns):
-                console.print(f"[yellow]Required columns not found in {file_name}. Skipping.[/yellow]")
-                progress.advance(task)
-                continue
-            
-            # Convert 'Date' column to datetime with explicit UTC handling
-            data['Date'] = pd.to_datetime(data['Date'], errors='coerce', utc=True)
-            
-            # Drop rows where 'Date' conversion failed
-            data = data.dropna(subset=['Date'])
-            
-            # Filter for the purchase date
-            purchase_row = data[data['Date'].dt.strftime('%Y-%m-%d') == purchase_date]
-            if purchase_row.empty:
-                console.print(f"[yellow]Purchase date not found in {file_name}. Skipping.[/yellow]")
-                progress.advance(task)
-                continue
-            
-            # Get the lowest price on the purchase date
-            purchase_price = purchase_row['Low'].values[0]
-            
-            # Get the last available row (latest price)
-            last_row = data.iloc[-1]
-            selling_price = last_row['Close']
-            
-            # Calculate number of shares bought with the allocated budget
-            budget_for_stock = total_budget * split_percentage
-            shares_bought = budget_for_stock / purchase_price
-            
-            # Calculate profit or loss
-            profit = shares_bought * selling_price - budget_for_stock
-            
-            # Calculate profit percentage
-            profit_percentage = (profit / budget_for_stock) * 100
-            
-            # Store the result
-            results[stock_name] = {
-                'Shares Bought': shares_bought,
-                'Purchase Price': purchase_price,
-                'Selling Price': selling_price,
-                'Profit': profit,
-                'Profit Percentage': profit_percentage
-            }
-        
-        except Exception as e:
-            console.print(f"[red]Error processing {file_name}: {e}[/red]")
-        
-        finally:
-            progress.advance(task)
+# Number of most profitable stocks to display (None displays all of them)
+top_k = None
 
-# Calculate combined profit
-total_profit = sum(result['Profit'] for result in results.values())
-total_profit_percent = (total_profit / total_budget) * 100
+# Total budget and the equal share of it for each stock
+total_budget = 900
+budget_for_stock = total_budget / len(target_files)
 
-# Sort the results by profit (from highest to lowest)
-sorted_results = sorted(results.items(), key=lambda x: x[1]['Profit'], reverse=True)
 
-# Create a Rich table for results
-table = Table(title="Stock Investment Results", title_style="bold magenta")
+def build_query(stock_names):
+    # One lazy query over the cached Parquet files of all given stocks, returning per stock:
+    # the slot in target_files, shares bought, purchase price, selling price, profit and profit percentage
+    paths = [parquet_path(stock_name) for stock_name in stock_names]
+    slots = {path: target_files.index(stock_name) for path, stock_name in zip(paths, stock_names)}
+    
+    lf = pl.scan_parquet(paths, include_file_paths='path').with_columns(
+        pl.col('path').replace_strict(slots, return_dtype=pl.Int64).alias('slot')
+    )
+    
+    # Get the lowest price on the purchase date; the date filter is pushed into the scan,
+    # so row groups outside the purchase day are skipped using their statistics
+    purchase = (
+        lf.filter((pl.col('Date') >= purchase_ts_start) & (pl.col('Date') < purchase_ts_end))
+        .group_by('slot')
+        .agg(pl.col('Low').first().cast(pl.Float64).alias('purchase_price'))
+    )
+    
+    # Get the last available row (latest price); cached files are sorted by date, so no sort is needed
+    latest = lf.select(['slot', 'Close']).group_by('slot').agg(pl.col('Close').last().cast(pl.Float64).alias('selling_price'))
+    
+    return (
+        purchase.join(latest, on='slot')
+        .with_columns((budget_for_stock / pl.col('purchase_price')).alias('shares_bought'))
+        .with_columns((pl.col('shares_bought') * pl.col('selling_price') - budget_for_stock).alias('profit'))
+        .with_columns((pl.col('profit') / budget_for_stock * 100).alias('profit_percentage'))
+        .select(['slot', 'shares_bought', 'purchase_price', 'selling_price', 'profit', 'profit_percentage'])
+    )
 
-table.add_column("Stock", style="cyan", no_wrap=True)
-table.add_column("Shares Bought", style="green", justify="right")
-table.add_column("Purchase Price", style="green", justify="right")
-table.add_column("Selling Price", style="green", justify="right")
-table.add_column("Profit", style="green", justify="right")
-table.add_column("Profit %", style="green", justify="right")
 
-for stock, result in sorted_results:
-    profit_color = "green" if result['Profit'] >= 0 else "red"
-    profit_text = f"[{profit_color}]{result['Profit']:.2f}[/{profit_color}]"
-    profit_percent_text = f"[{profit_color}]{result['Profit Percentage']:.2f}%[/{profit_color}]"
+if __name__ == '__main__':
+    # Initialize result arrays, one slot per stock
+    n = len(target_files)
+    shares = np.zeros(n)
+    purchase = np.zeros(n)
+    selling = np.zeros(n)
+    profits = np.zeros(n)
+    profit_percentages = np.zeros(n)
+    found = np.zeros(n, dtype=bool)
+    
+    # Ensure the directory exists and has files
+    if not os.path.exists(data_dir) or not os.listdir(data_dir):
+        console.print("[bold red]No files found in the data directory.[/bold red]")
+        exit()
+    
+    # Convert new or updated CSV files to Parquet
+    cache_errors = prepare_cache(target_files)
+    
+    # Warnings are collected and printed once processing is done
+    messages = []
     
+    # Only query stocks whose CSV file still exists and converted cleanly; a stale Parquet file
+    # can outlive its deleted CSV. Stocks with a CSV but no cached file lack the required columns
+    cached = [
+        stock_name for stock_name in target_files
+        if os.path.exists(csv_path(stock_name)) and stock_name not in cache_errors and os.path.exists(parquet_path(stock_name))
+    ]
+    
+    try:
+        query_errors = {}
+        try:
+            query_results = [build_query(cached).collect()] if cached else []
+        except Exception:
+            # One unreadable file fails the combined query, so run each stock on its own to isolate it.
+            # Only this path processes stocks one by one, so it is the only one with a progress bar
+            query_results = []
+            show_progress = len(cached) > progress_threshold
+            with (Progress() if show_progress else nullcontext()) as progress:
+                task = progress.add_task("[cyan]Processing stock files...", total=len(cached)) if show_progress else None
+                for stock_name in cached:
+                    try:
+                        query_results.append(build_query([stock_name]).collect())
+                    except Exception as e:
+                        query_errors[stock_name] = (str(e).splitlines() or [type(e).__name__])[0]
+                    finally:
+                        if show_progress:
+                            progress.advance(task)
+        
+        for result in query_results:
+            slots = result['slot'].to_numpy()
+            shares[slots] = result['shares_bought'].to_numpy()
+            purchase[slots] = result['purchase_price'].to_numpy()
+            selling[slots] = result['selling_price'].to_numpy()
+            profits[slots] = result['profit'].to_numpy()
+            profit_percentages[slots] = result['profit_percentage'].to_numpy()
+            found[slots] = True
+        
+        for i, stock_name in enumerate(target_files):
+            file_name = f"{stock_name}.csv"
+            if not os.path.exists(csv_path(stock_name)):
+                messages.append(f"[yellow]File {file_name} not found. Skipping.[/yellow]")
+            elif stock_name in cache_errors:
+                messages.append(f"[red]Error processing {file_name}: {cache_errors[stock_name]}[/red]")
+            elif stock_name not in cached:
+                messages.append(f"[yellow]Required columns not found in {file_name}. Skipping.[/yellow]")
+            elif stock_name in query_errors:
+                messages.append(f"[red]Error processing {file_name}: {query_errors[stock_name]}[/red]")
+            elif not found[i]:
+                messages.append(f"[yellow]Purchase date not found in {file_name}. Skipping.[/yellow]")
+    
+    except Exception as e:
+        messages.append(f"[red]Error processing stock files: {e}[/red]")
+    
+    for message in messages:
+        console.print(message)
+    
+    # Calculate combined profit
+    total_profit = profits.sum()
+    total_profit_percent = (total_profit / total_budget) * 100
+    
+    # Sort the results by profit (from highest to lowest), keeping only the top_k stocks if set
+    found_slots = np.flatnonzero(found)
+    if top_k is not None and len(found_slots) > top_k:
+        found_slots = np.sort(found_slots[np.argpartition(-profits[found_slots], top_k - 1)[:top_k]])
+    order = found_slots[np.argsort(-profits[found_slots], kind='stable')]
+    
+    # Create a Rich table for results
+    table = Table(title="Stock Investment Results", title_style="bold magenta")
+    
+    table.add_column("Stock", style="cyan", no_wrap=True)
+    table.add_column("Shares Bought", style="green", justify="right")
+    table.add_column("Purchase Price", style="green", justify="right")
+    table.add_column("Selling Price", style="green", justify="right")
+    table.add_column("Profit", style="green", justify="right")
+    table.add_column("Profit %", style="green", justify="right")
+    
+    # Format all rows up front, picking each row's profit color once
+    rows = []
+    for i in order:
+        color = "green" if profits[i] >= 0 else "red"
+        rows.append((
+            target_files[i],
+            f"{shares[i]:.4f}",
+            f"${purchase[i]:.2f}",
+            f"${selling[i]:.2f}",
+            f"[{color}]{profits[i]:.2f}[/{color}]",
+            f"[{color}]{profit_percentages[i]:.2f}%[/{color}]"
+        ))
+    
+    for row in rows:
+        table.add_row(*row)
+    
+    # Add a total row
+    table.add_section()
     table.add_row(
-        stock,
-        f"{result['Shares Bought']:.4f}",
-        f"${result['Purchase Price']:.2f}",
-        f"${result['Selling Price']:.2f}",
-        profit_text,
-        profit_percent_text
+        "[bold]Total[/bold]",
+        "",
+        "",
+        "",
+        f"[bold]{total_profit:.2f}[/bold]",
+        f"[bold]{total_profit_percent:.2f}%[/bold]"
     )
-
-# Add a total row
-table.add_section()
-table.add_row(
-    "[bold]Total[/bold]",
-    "",
-    "",
-    "",
-    f"[bold]{total_profit:.2f}[/bold]",
-    f"[bold]{total_profit_percent:.2f}%[/bold]"
-)
-
-# Display the table within a panel
-console.print(Panel(table, border_style="bold blue"))
-
-# If no results, display a message
-if not sorted_results:
-    console.print("[bold red]No results to display.[/bold red]")
+    
+    # Display the table within a panel
+    console.print(Panel(table, border_style="bold blue"))
+    
+    # If no results, display a message
+    if len(order) == 0:
+        console.print("[bold red]No results to display.[/bold red]")
@@ -0,0 +1,101 @@
+import polars as pl
+import os
+
+# Directory containing the CSV files
+data_dir = './data'
+
+# Version of the cached file contents; bump it whenever prepare_cache changes what it writes
+# (columns, types, parsing or row order) so existing caches are rebuilt instead of reused
+cache_version = 2
+
+# Directory holding the Parquet copies of the CSV files, one subdirectory per cache version
+cache_dir = os.path.join('./data_parquet', f"v{cache_version}")
+
+# Columns used by the scripts
+required_columns = ['Date', 'Low', 'Close']
+
+# Types of the required columns, passed to the CSV reader instead of being inferred.
+# Prices only have a few significant digits, so float32 is enough and halves their size
+column_types = {'Date': pl.String, 'Low': pl.Float32, 'Close': pl.Float32}
+
+# Values read as missing, the same tokens pd.read_csv treats as NaN by default
+null_values = [
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null',
+]
+
+# Accepted formats of the 'Date' column, tried in order: ISO 8601 with a UTC offset
+# (e.g. 2024-03-01 00:00:00-05:00), then naive date-times and plain dates, which are taken as UTC
+date_formats = ['%+', '%Y-%m-%d %H:%M:%S%.f', '%Y-%m-%dT%H:%M:%S%.f', '%Y-%m-%d']
+
+
+def csv_path(stock_name):
+    return os.path.join(data_dir, f"{stock_name}.csv")
+
+
+def parquet_path(stock_name):
+    return os.path.join(cache_dir, f"{stock_name}.parquet")
+
+
+def prepare_cache(stock_names):
+    # Convert each CSV to Parquet once, re-converting only when the CSV is newer.
+    # Returns the error message of every stock whose CSV could not be converted; those stay uncached
+    os.makedirs(cache_dir, exist_ok=True)
+    errors = {}
+
+    for stock_name in stock_names:
+        source_path = csv_path(stock_name)
+        out_path = parquet_path(stock_name)
+        tmp_path = f"{out_path}.tmp"
+
+        if not os.path.exists(source_path):
+            continue
+
+        if os.path.exists(out_path) and os.path.getmtime(out_path) >= os.path.getmtime(source_path):
+            continue
+
+        try:
+            lf = pl.scan_csv(source_path, schema_overrides=column_types, null_values=null_values)
+
+            # Files without the required columns are left uncached
+            if not set(required_columns).issubset(lf.collect_schema().names()):
+                if os.path.exists(out_path):
+                    os.remove(out_path)
+                continue
+
+            # Parse dates with the first matching format, converting to UTC; unparsable dates become null
+            # and are dropped. Rows are stored sorted by date so readers can binary search them
+            (
+                lf.select(required_columns)
+                .with_columns(pl.coalesce([
+                    pl.col('Date').str.to_datetime(date_format, time_zone='UTC', strict=False, cache=True)
+                    for date_format in date_formats
+                ]))
+                .drop_nulls('Date')
+                .sort('Date')
+                .sink_parquet(tmp_path, compression='zstd')
+            )
+
+            # A file whose dates all failed to parse is an error, not a stock without data
+            if pl.scan_parquet(tmp_path).select(pl.len()).collect().item() == 0:
+                if lf.select(pl.col('Date').is_not_null().any()).collect().item():
+                    raise ValueError("no date in the 'Date' column could be parsed")
+
+            # Only replace the cached file once the new one is complete
+            os.replace(tmp_path, out_path)
+
+        except Exception as e:
+            # Keep only the first line; Polars appends hints about schema inference that do not apply here
+            errors[stock_name] = (str(e).splitlines() or [type(e).__name__])[0]
+            for path in (tmp_path, out_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    return errors
+
+
+def load_stock(stock_name):
+    # Returns the sorted dates (UTC datetime64) and the "Low" and "Close" prices of a cached stock.
+    # Each run reads every stock once, so the arrays are not cached in-process
+    data = pl.read_parquet(parquet_path(stock_name))
+    return data['Date'].to_numpy(), data['Low'].to_numpy(), data['Close'].to_numpy()
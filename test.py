@@ -1,123 +1,166 @@
+import numba
+import numpy as np
 import pandas as pd
 import os
-
-# Directory containing the CSV files
-data_dir = './data'
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from stock_cache import data_dir, csv_path, parquet_path, prepare_cache, load_stock
 
 # Specific stocks to process (without .csv)
 target_files = ['AAPL', 'WMT', 'GOOGL', 'AMZN', 'MSFT', 'TSLA', 'META', 'NFLX', 'BA', 'DIS', 'PYPL', 'V', 'MA', 'INTC', 'IBM', 'AMD']
 
 # Monthly investment details
 monthly_budget = 100
-split_percentage = 1 / len(target_files)  # Split equally across stocks
+monthly_allocation = monthly_budget / len(target_files)  # Split equally across stocks
+
+# Process stocks in parallel only for more stocks than this; below it, starting workers
+# (each re-importing pandas, numba and polars) costs more than processing the files
+parallel_threshold = 50
+
+# Number of most profitable stocks to display (None displays all of them)
+top_k = None
 
 # Date from which to start investing
 start_investment_date = pd.to_datetime('2024-03-01').tz_localize('UTC')
 
-# Initialize results dictionary
-results = {}
-investment_history = {stock: [] for stock in target_files}
 
-# Ensure the directory exists and has files
-if not os.path.exists(data_dir) or not os.listdir(data_dir):
-    print("No files found in the data directory.")
-    exit()
+@numba.njit(cache=True)
+def monthly_rows(dates, invest_dates):
+    # Two-pointer merge of the sorted dates and investment dates: for each investment date,
+    # the index of the latest row on or before it (-1 if there is none)
+    chosen_rows = np.full(len(invest_dates), -1, dtype=np.int64)
+    row = -1
+    for month in range(len(invest_dates)):
+        while row + 1 < len(dates) and dates[row + 1] <= invest_dates[month]:
+            row += 1
+        chosen_rows[month] = row
+    return chosen_rows
 
-for stock_name in target_files:
+
+def process_stock(stock_name, cache_error=None):
+    # Returns the stock name, its monthly purchases (or None) and a message to print (or None).
+    # Purchases are the investment dates, the "Low" prices paid and the final "Close" price.
+    # cache_error is the message from converting the stock's CSV, if that failed.
     file_name = f"{stock_name}.csv"
-    file_path = os.path.join(data_dir, file_name)
+    file_path = parquet_path(stock_name)
+    
+    if not os.path.exists(csv_path(stock_name)):
+        return stock_name, None, f"File {file_name} not found. Skipping."
     
-    if not os.path.exists(file_path):
-        print(f"File {file_name} not found. Skipping.")
-        continue
+    if cache_error:
+        return stock_name, None, f"Error processing {file_name}: {cache_error}"
     
     try:
-        # Read the CSV file
-        data = pd.read_csv(file_path)
-        
-        # Check for required columns
-        if not {'Date', 'Low', 'Close'}.issubset(data.columns):
-            print(f"Required columns not found in {file_name}. Skipping.")
-            continue
+        # CSV files without the required columns are not cached
+        if not os.path.exists(file_path):
+            return stock_name, None, f"Required columns not found in {file_name}. Skipping."
         
-        # Convert 'Date' column to datetime with UTC handling
-        data['Date'] = pd.to_datetime(data['Date'], errors='coerce', utc=True)
-        data = data.dropna(subset=['Date']).sort_values(by='Date')
+        # Read the cached Parquet file, starting from March 1st, 2024
+        dates, lows, closes = load_stock(stock_name)
+        first_row = np.searchsorted(dates, start_investment_date.to_datetime64())
+        dates, lows = dates[first_row:], lows[first_row:]
         
-        # Filter data starting from March 1st, 2024
-        data = data[data['Date'] >= start_investment_date]
-        
-        if data.empty:
-            print(f"No data available after {start_investment_date} for {file_name}. Skipping.")
-            continue
+        if len(dates) == 0:
+            return stock_name, None, f"No data available after {start_investment_date} for {file_name}. Skipping."
         
         # Extract date range for investments
-        start_date = data['Date'].iloc[0]
-        end_date = data['Date'].iloc[-1]
+        start_date = dates[0]
+        end_date = dates[-1]
         
         # Generate a range of investment dates (monthly)
-        monthly_dates = pd.date_range(start=start_date, end=end_date, freq='MS')
-        
-        # Track shares purchased
-        total_shares = 0
-        total_investment = 0
+        monthly_dates = pd.date_range(start=start_date, end=end_date, freq='MS', tz='UTC')
         
-        for invest_date in monthly_dates:
-            # Find the closest date in the dataset for this investment
-            available_row = data[data['Date'] <= invest_date].iloc[-1:]
-            if available_row.empty:
-                continue
-            
-            # Use the "Low" price for purchasing shares
-            low_price = available_row['Low'].values[0]
-            monthly_allocation = monthly_budget * split_percentage
-            shares_bought = monthly_allocation / low_price
-            
-            # Update investment totals
-            total_shares += shares_bought
-            total_investment += monthly_allocation
-            investment_history[stock_name].append({
-                'Date': invest_date,
-                'Shares Bought': shares_bought,
-                'Price': low_price
-            })
+        # Find the closest date in the dataset for every investment
+        invest_dates = monthly_dates.values.astype(dates.dtype)
+        rows = monthly_rows(dates.view(np.int64), invest_dates.view(np.int64))
+        valid = rows >= 0
         
         # Final price for profit calculation
-        final_close_price = data['Close'].iloc[-1]
-        profit = total_shares * final_close_price - total_investment
-        profit_percentage = (profit / total_investment) * 100 if total_investment > 0 else 0
+        final_close_price = closes[-1]
         
-        # Store the result
-        results[stock_name] = {
-            'Total Shares': total_shares,
-            'Total Investment': total_investment,
-            'Final Price': final_close_price,
-            'Profit': profit,
-            'Profit Percentage': profit_percentage
-        }
+        return stock_name, (monthly_dates[valid], lows[rows[valid]], final_close_price), None
     
     except Exception as e:
-        print(f"Error processing {file_name}: {e}")
-
-# Calculate combined profit
-total_profit = sum(result['Profit'] for result in results.values())
-total_investment = sum(result['Total Investment'] for result in results.values())
+        return stock_name, None, f"Error processing {file_name}: {e}"
 
-# Handle potential division by zero when calculating profit percentage
-total_profit_percent = (total_profit / total_investment) * 100 if total_investment > 0 else 0
 
-# Sort the results by profit (from highest to lowest)
-sorted_results = sorted(results.items(), key=lambda x: x[1]['Profit'], reverse=True)
-
-# Print results
-if sorted_results:
-    print(f"{'Stock':<10} {'Total Shares':<15} {'Total Investment':<20} {'Final Price':<15} {'Profit':<10} {'Profit %':<10}")
-    print("=" * 90)
+if __name__ == '__main__':
+    investment_history = {stock: [] for stock in target_files}
+    purchases = {}
+    messages = []
+    
+    # Ensure the directory exists and has files
+    if not os.path.exists(data_dir) or not os.listdir(data_dir):
+        print("No files found in the data directory.")
+        exit()
     
-    for stock, result in sorted_results:
-        print(f"{stock:<10} {result['Total Shares']:<15.4f} {result['Total Investment']:<20.2f} {result['Final Price']:<15.2f} {result['Profit']:<10.2f} {result['Profit Percentage']:<10.2f}")
+    # Convert new or updated CSV files to Parquet
+    cache_errors = prepare_cache(target_files)
     
-    print("=" * 90)
-    print(f"{'Total':<10} {'':<15} {total_investment:<20.2f} {'':<15} {total_profit:<10.2f} {total_profit_percent:.2f}%")
-else:
-    print("No results to display.")
+    # Process files, in parallel for large batches; Polars is not fork-safe, so workers are spawned
+    parallel = len(target_files) > parallel_threshold
+    with (ProcessPoolExecutor(mp_context=multiprocessing.get_context('spawn')) if parallel else nullcontext()) as executor:
+        map_stocks = executor.map if parallel else map
+        for stock_name, stock_purchases, message in map_stocks(process_stock, target_files, [cache_errors.get(stock_name) for stock_name in target_files]):
+            if message:
+                messages.append(message)
+            if stock_purchases:
+                purchases[stock_name] = stock_purchases
+    
+    # Print the workers' warnings once all of them are done
+    for message in messages:
+        print(message)
+    
+    # Stack the "Low" prices of all stocks into one (stocks x months) matrix, padding with NaN.
+    # Padding is tracked by a separate mask, since a missing "Low" price is NaN as well
+    stock_names = list(purchases)
+    purchase_counts = np.array([len(low_prices) for _, low_prices, _ in purchases.values()], dtype=np.int64)
+    months = int(purchase_counts.max(initial=0))
+    low_matrix = np.full((len(stock_names), months), np.nan, dtype=np.float32)
+    for i, (_, low_prices, _) in enumerate(purchases.values()):
+        low_matrix[i, :len(low_prices)] = low_prices
+    final_close = np.array([final_close_price for _, _, final_close_price in purchases.values()], dtype=np.float64)
+    
+    # Compute the investment totals of every stock in one pass, accumulating in float64
+    invested = np.arange(months) < purchase_counts[:, None]
+    shares_matrix = np.where(invested, monthly_allocation / low_matrix, 0)
+    total_shares = shares_matrix.sum(axis=1, dtype=np.float64)
+    total_investments = monthly_allocation * invested.sum(axis=1)
+    profits = total_shares * final_close - total_investments
+    profit_percentages = np.divide(profits * 100, total_investments, out=np.zeros_like(profits), where=total_investments > 0)
+    
+    for i, stock_name in enumerate(stock_names):
+        invest_dates, low_prices, _ = purchases[stock_name]
+        # Convert each row to Python floats in bulk instead of boxing one NumPy scalar per month
+        investment_history[stock_name] = [
+            {'Date': invest_date, 'Shares Bought': shares, 'Price': price}
+            for invest_date, shares, price in zip(invest_dates, shares_matrix[i, :len(low_prices)].tolist(), low_prices.tolist())
+        ]
+    
+    # Calculate combined profit
+    total_profit = profits.sum()
+    total_investment = total_investments.sum()
+    
+    # Handle potential division by zero when calculating profit percentage
+    total_profit_percent = (total_profit / total_investment) * 100 if total_investment > 0 else 0
+    
+    # Sort the results by profit (from highest to lowest), keeping only the top_k stocks if set
+    if top_k is not None and len(profits) > top_k:
+        top = np.sort(np.argpartition(-profits, top_k - 1)[:top_k])
+        order = top[np.argsort(-profits[top], kind='stable')]
+    else:
+        order = np.argsort(-profits, kind='stable')
+    
+    # Print results
+    if len(order) > 0:
+        print(f"{'Stock':<10} {'Total Shares':<15} {'Total Investment':<20} {'Final Price':<15} {'Profit':<10} {'Profit %':<10}")
+        print("=" * 90)
+        
+        for i in order:
+            print(f"{stock_names[i]:<10} {total_shares[i]:<15.4f} {total_investments[i]:<20.2f} {final_close[i]:<15.2f} {profits[i]:<10.2f} {profit_percentages[i]:<10.2f}")
+        
+        print("=" * 90)
+        print(f"{'Total':<10} {'':<15} {total_investment:<20.2f} {'':<15} {total_profit:<10.2f} {total_profit_percent:.2f}%")
+    else:
+        print("No results to display.")